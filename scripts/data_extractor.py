@@ -5,19 +5,29 @@ Scrapes product data from major SA retailers and formats for Budget Sakkie
 """
 
 import asyncio
-import aiohttp
 import csv
-import json
 import os
 import time
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, NamedTuple, Optional, Tuple
 import logging
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass
+from operator import attrgetter
 from urllib.parse import urljoin, urlparse
-import random
 import re
+from array import array
+from collections import Counter
+from functools import lru_cache
+
+import httpx
+import numpy as np
+import orjson
+
+try:
+    import ahocorasick
+except ImportError:  # pyahocorasick is optional; fall back to the compiled regex
+    ahocorasick = None
 
 # Configure logging
 logging.basicConfig(
@@ -30,7 +40,29 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@dataclass
+# Pre-compiled patterns used on the per-product sanitization path
+_PRICE_RE = re.compile(r'R?\s*(\d+(?:\.\d{2})?)')
+_WS_RE = re.compile(r'\s+')
+_SLUG_RE = re.compile(r'[^a-z0-9]')
+_AVAIL_RE = re.compile(
+    r'(in stock|available|yes|low stock|limited|few left|out of stock|unavailable|sold out)'
+)
+_VALID_STATUSES = frozenset({"in_stock", "low_stock", "out_of_stock", "unknown"})
+# The earliest term in the text decides the status, not a fixed in/low/out priority:
+# "Unavailable" and "Out of stock: available soon" are out_of_stock, "few left in stock" is low_stock
+_AVAIL_STATUS = {
+    "in stock": "in_stock",
+    "available": "in_stock",
+    "yes": "in_stock",
+    "low stock": "low_stock",
+    "limited": "low_stock",
+    "few left": "low_stock",
+    "out of stock": "out_of_stock",
+    "unavailable": "out_of_stock",
+    "sold out": "out_of_stock",
+}
+
+@dataclass(slots=True)
 class Product:
     """Product data structure"""
     product_name: str
@@ -43,6 +75,25 @@ class Product:
     image_url: str = ""
     product_id: str = ""
 
+# Column order for the per-retailer price CSVs
+_CSV_FIELDNAMES = [
+    'product_id', 'product_name', 'current_price', 'availability_status',
+    'last_updated', 'retailer', 'category', 'unit', 'image_url'
+]
+_CSV_ROW = attrgetter(*_CSV_FIELDNAMES)
+_CSV_BUFFER_SIZE = 1 << 20  # 1 MiB write buffer
+
+@lru_cache(maxsize=4096)
+def _slugify(text: str) -> str:
+    """Lowercase text and replace anything non-alphanumeric with dashes"""
+    return _SLUG_RE.sub('-', text.lower())
+
+class ProductAnalysis(NamedTuple):
+    """Result of a single validation and statistics pass over products"""
+    is_valid: bool
+    errors: List[str]
+    summary: Dict
+
 class RateLimiter:
     """Rate limiter to respect website policies"""
     def __init__(self, requests_per_second: float = 0.5):
@@ -63,11 +114,15 @@ class RateLimiter:
 class GroceryDataExtractor:
     """Main data extraction class"""
     
-    def __init__(self):
-        self.rate_limiter = RateLimiter(0.5)  # 0.5 requests per second
+    def __init__(self, force_refresh: bool = False):
+        self.force_refresh = force_refresh  # Ignore today's cached CSVs when True
         self.session = None
+        self.summary = {}
+        self.rng = np.random.default_rng()
+        self.start_run()
         self.data_dir = Path("data")
         self.setup_directories()
+        self._avail_automaton = self.build_availability_automaton()
         
         # Top 50 most commonly purchased grocery items in SA
         self.target_products = [
@@ -138,6 +193,18 @@ class GroceryDataExtractor:
                 }
             }
         }
+        
+        # URL-safe retailer names, used as the product ID prefix
+        self.retailer_slugs = {key: _slugify(retailer["name"]) for key, retailer in self.retailers.items()}
+        
+        # One rate limiter per retailer so concurrent scrapes don't share state
+        self.rate_limiters = {key: RateLimiter(0.5) for key in self.retailers}  # 0.5 requests per second
+    
+    def start_run(self):
+        """Capture the run timestamp once so every output of a run shares it"""
+        self.run_date = datetime.now()
+        self.run_date_str = self.run_date.strftime("%Y-%m-%d")
+        self.run_iso = self.run_date.isoformat()
     
     def setup_directories(self):
         """Create necessary directories"""
@@ -150,26 +217,32 @@ class GroceryDataExtractor:
         logger.info("✅ Directory structure created")
     
     async def create_session(self):
-        """Create aiohttp session with proper configuration"""
-        timeout = aiohttp.ClientTimeout(total=30)
-        connector = aiohttp.TCPConnector(limit=10, limit_per_host=2)
+        """Create HTTP/2 capable httpx client with a keep-alive connection pool"""
+        # Keep up to 10 warm connections per retailer so idle gaps between
+        # searches don't force a new TLS handshake; the per-retailer
+        # RateLimiter still governs how often each host is hit.
+        limits = httpx.Limits(
+            max_connections=100,
+            max_keepalive_connections=10 * len(self.retailers),
+            keepalive_expiry=60.0
+        )
         
-        self.session = aiohttp.ClientSession(
-            timeout=timeout,
-            connector=connector,
+        self.session = httpx.AsyncClient(
+            http2=True,
+            limits=limits,
+            timeout=30.0,
             headers={
                 "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
                 "Accept-Language": "en-US,en;q=0.5",
                 "Accept-Encoding": "gzip, deflate",
-                "Connection": "keep-alive",
                 "Upgrade-Insecure-Requests": "1"
             }
         )
     
     async def close_session(self):
-        """Close aiohttp session"""
+        """Close httpx client"""
         if self.session:
-            await self.session.close()
+            await self.session.aclose()
     
     def sanitize_price(self, price_text: str) -> Optional[float]:
         """Extract and sanitize price from text"""
@@ -177,7 +250,7 @@ class GroceryDataExtractor:
             return None
         
         # Remove currency symbols and extract numeric value
-        price_match = re.search(r'R?\s*(\d+(?:\.\d{2})?)', price_text.replace(',', ''))
+        price_match = _PRICE_RE.search(price_text.replace(',', ''))
         if price_match:
             try:
                 return float(price_match.group(1))
@@ -190,15 +263,24 @@ class GroceryDataExtractor:
         if not text:
             return ""
         
-        return re.sub(r'\s+', ' ', text.strip())[:200]  # Limit length
+        return _WS_RE.sub(' ', text.strip())[:200]  # Limit length
     
-    def generate_product_id(self, retailer: str, product_name: str) -> str:
+    def generate_product_id(self, retailer_key: str, product_name: str) -> str:
         """Generate unique product ID"""
-        clean_name = re.sub(r'[^a-z0-9]', '-', product_name.lower())
-        clean_retailer = re.sub(r'[^a-z0-9]', '-', retailer.lower())
         timestamp = int(time.time())
         
-        return f"{clean_retailer}-{clean_name}-{timestamp}"
+        return f"{self.retailer_slugs[retailer_key]}-{_slugify(product_name)}-{timestamp}"
+    
+    def build_availability_automaton(self):
+        """Build a single-pass keyword matcher for availability terms"""
+        if ahocorasick is None:
+            return None
+        
+        automaton = ahocorasick.Automaton()
+        for term, status in _AVAIL_STATUS.items():
+            automaton.add_word(term, status)
+        automaton.make_automaton()
+        return automaton
     
     def parse_availability(self, availability_text: str) -> str:
         """Parse availability status from text"""
@@ -207,18 +289,54 @@ class GroceryDataExtractor:
         
         text = availability_text.lower()
         
-        if any(term in text for term in ["in stock", "available", "yes"]):
-            return "in_stock"
-        elif any(term in text for term in ["low stock", "limited", "few left"]):
-            return "low_stock"
-        elif any(term in text for term in ["out of stock", "unavailable", "sold out"]):
-            return "out_of_stock"
+        if self._avail_automaton is not None:
+            for _, status in self._avail_automaton.iter(text):
+                return status
+            return "in_stock"  # Default assumption
+        
+        match = _AVAIL_RE.search(text)
+        if match:
+            return _AVAIL_STATUS[match.group(1)]
         
         return "in_stock"  # Default assumption
     
-    async def scrape_retailer_products(self, retailer_key: str) -> List[Product]:
-        """Scrape products from a specific retailer"""
+    def cached_csv_path(self, retailer_key: str) -> Path:
+        """Path of today's price CSV for a retailer"""
+        return self.data_dir / retailer_key / f"{self.run_date_str}_prices.csv"
+    
+    def load_cached_products(self, csv_path: Path) -> List[Product]:
+        """Load products previously saved by save_to_csv"""
+        products = []
+        
+        with open(csv_path, 'r', newline='', encoding='utf-8') as csvfile:
+            for row in csv.DictReader(csvfile):
+                # DictReader fills the fields of a truncated row with None
+                if None in row.values():
+                    raise ValueError(f"incomplete row on line {len(products) + 2}")
+                
+                product = Product(**row)
+                product.current_price = float(product.current_price)
+                products.append(product)
+        
+        if not products:
+            raise ValueError("no products in file")
+        
+        return products
+    
+    async def scrape_retailer_products(self, retailer_key: str) -> Tuple[List[Product], bool]:
+        """Scrape products from a specific retailer; the flag is True when they came from today's cache"""
         retailer = self.retailers[retailer_key]
+        
+        # Reuse today's data if this retailer has already been scraped
+        cached_path = self.cached_csv_path(retailer_key)
+        if cached_path.exists() and not self.force_refresh:
+            try:
+                products = self.load_cached_products(cached_path)
+                logger.info(f"♻️ Loaded {len(products)} cached products for {retailer['name']} from {cached_path}")
+                return products, True
+            except (ValueError, TypeError, csv.Error) as e:
+                logger.warning(f"⚠️ Ignoring unreadable cache {cached_path}: {str(e)}")
+        
         logger.info(f"🏪 Starting to scrape {retailer['name']}...")
         
         products = []
@@ -235,15 +353,14 @@ class GroceryDataExtractor:
         except Exception as e:
             logger.error(f"❌ Error scraping {retailer['name']}: {str(e)}")
         
-        return products
+        return products, False
     
     async def simulate_retailer_data(self, retailer_key: str) -> List[Product]:
         """Simulate realistic product data for demo purposes"""
         retailer = self.retailers[retailer_key]
-        products = []
         
         # Simulate rate limiting
-        await self.rate_limiter.wait_if_needed()
+        await self.rate_limiters[retailer_key].wait_if_needed()
         
         # Sample product data with realistic SA pricing
         sample_data = {
@@ -299,56 +416,63 @@ class GroceryDataExtractor:
             ]
         }
         
-        current_time = datetime.now().isoformat()
+        current_time = self.run_iso
         
-        for item in sample_data.get(retailer_key, []):
-            # Add some price variation
-            price_variation = random.uniform(0.9, 1.1)
-            adjusted_price = round(item["price"] * price_variation, 2)
-            
-            product = Product(
-                product_id=self.generate_product_id(retailer["name"], item["name"]),
+        # Draw all random values for this batch in a few vectorized calls
+        items = sample_data.get(retailer_key, [])
+        count = len(items)
+        price_variations = self.rng.uniform(0.9, 1.1, count).tolist()
+        statuses = self.rng.choice(["in_stock", "low_stock"], size=count, p=[0.75, 0.25]).tolist()
+        image_ids = self.rng.integers(100000, 1000000, count).tolist()
+        
+        # Product IDs share one timestamp for the whole batch
+        id_prefix = self.retailer_slugs[retailer_key]
+        timestamp = int(time.time())
+        
+        return [
+            Product(
+                product_id=f"{id_prefix}-{_slugify(item['name'])}-{timestamp}",
                 product_name=item["name"],
-                current_price=adjusted_price,
-                availability_status=random.choice(["in_stock", "in_stock", "in_stock", "low_stock"]),
+                current_price=round(item["price"] * price_variations[i], 2),  # Add some price variation
+                availability_status=statuses[i],
                 last_updated=current_time,
                 retailer=retailer["name"],
                 category=item["category"],
                 unit=item["unit"],
-                image_url=f"https://images.pexels.com/photos/{random.randint(100000, 999999)}/product.jpg"
+                image_url=f"https://images.pexels.com/photos/{image_ids[i]}/product.jpg"
             )
-            
-            products.append(product)
-        
-        return products
+            for i, item in enumerate(items)
+        ]
     
     def save_to_csv(self, products: List[Product], retailer_key: str):
         """Save products to CSV file with timestamp"""
-        timestamp = datetime.now().strftime("%Y-%m-%d")
-        filename = f"{timestamp}_prices.csv"
+        filename = f"{self.run_date_str}_prices.csv"
         filepath = self.data_dir / retailer_key / filename
         
         # Ensure directory exists
         filepath.parent.mkdir(parents=True, exist_ok=True)
         
-        with open(filepath, 'w', newline='', encoding='utf-8') as csvfile:
-            fieldnames = [
-                'product_id', 'product_name', 'current_price', 'availability_status',
-                'last_updated', 'retailer', 'category', 'unit', 'image_url'
-            ]
-            
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
+        # Write to a temporary file and swap it in, so the daily cache never sees a partial CSV
+        tmp_path = filepath.with_suffix('.csv.tmp')
+        try:
+            with open(tmp_path, 'w', newline='', encoding='utf-8', buffering=_CSV_BUFFER_SIZE) as csvfile:
+                writer = csv.writer(csvfile)
+                writer.writerow(_CSV_FIELDNAMES)
+                writer.writerows(map(_CSV_ROW, products))
             
-            for product in products:
-                writer.writerow(asdict(product))
+            os.replace(tmp_path, filepath)
+        finally:
+            tmp_path.unlink(missing_ok=True)
         
         logger.info(f"💾 Saved {len(products)} products to {filepath}")
         return filepath
     
-    def validate_data_integrity(self, products: List[Product]) -> Tuple[bool, List[str]]:
-        """Validate data integrity before publishing"""
+    def analyze_products(self, products: List[Product]) -> ProductAnalysis:
+        """Validate products and collect summary statistics in a single pass"""
         errors = []
+        prices = []
+        retailer_counts = Counter()
+        category_counts = Counter()
         
         for i, product in enumerate(products):
             # Check required fields
@@ -357,12 +481,17 @@ class GroceryDataExtractor:
             
             if not product.current_price or product.current_price <= 0:
                 errors.append(f"Product {i}: Invalid price: {product.current_price}")
+            else:
+                prices.append(product.current_price)
             
             if not product.retailer:
                 errors.append(f"Product {i}: Missing retailer")
             
-            if product.availability_status not in ["in_stock", "low_stock", "out_of_stock", "unknown"]:
+            if product.availability_status not in _VALID_STATUSES:
                 errors.append(f"Product {i}: Invalid availability status: {product.availability_status}")
+            
+            retailer_counts[product.retailer] += 1
+            category_counts[product.category] += 1
         
         is_valid = len(errors) == 0
         
@@ -373,48 +502,123 @@ class GroceryDataExtractor:
             for error in errors[:10]:  # Show first 10 errors
                 logger.warning(f"   {error}")
         
+        summary = {
+            "total_products": len(products),
+            "retailers": retailer_counts,
+            "categories": category_counts,
+            "prices": prices
+        }
+        
+        return ProductAnalysis(is_valid, errors, summary)
+    
+    def summarize_products(self, products: List[Product]) -> Dict:
+        """Collect summary statistics for products that have already been validated"""
+        retailer_counts = Counter()
+        category_counts = Counter()
+        prices = []
+        
+        for product in products:
+            retailer_counts[product.retailer] += 1
+            category_counts[product.category] += 1
+            prices.append(product.current_price)
+        
+        return {
+            "total_products": len(products),
+            "retailers": retailer_counts,
+            "categories": category_counts,
+            "prices": prices
+        }
+    
+    def save_errors(self, errors: List[str], retailer_key: str):
+        """Save validation errors for a retailer to a text file"""
+        error_file = self.data_dir / retailer_key / f"errors_{self.run_date_str}.txt"
+        with open(error_file, 'w') as f:
+            f.write('\n'.join(errors))
+        
+        return error_file
+    
+    def validate_data_integrity(self, products: List[Product]) -> Tuple[bool, List[str]]:
+        """Validate data integrity before publishing"""
+        is_valid, errors, _ = self.analyze_products(products)
         return is_valid, errors
     
-    async def extract_all_data(self):
+    def merge_summary(self, totals: Dict, summary: Dict):
+        """Fold one retailer's statistics into the running extraction totals"""
+        totals["total_products"] += summary["total_products"]
+        totals["retailers"].update(summary["retailers"])
+        totals["categories"].update(summary["categories"])
+        totals["prices"].extend(summary["prices"])
+    
+    async def process_retailer(self, retailer_key: str, totals: Dict) -> int:
+        """Scrape, validate and save products for a single retailer"""
+        retailer_name = self.retailers[retailer_key]['name']
+        logger.info(f"\n📊 Processing {retailer_name}...")
+        
+        # Extract products
+        products, from_cache = await self.scrape_retailer_products(retailer_key)
+        
+        if not products:
+            return 0
+        
+        if from_cache:
+            # Today's CSV is only written after validation passes, so it is neither rechecked nor rewritten
+            summary = self.summarize_products(products)
+        else:
+            # Validate data and gather statistics
+            is_valid, errors, summary = self.analyze_products(products)
+            
+            if not is_valid:
+                logger.error(f"❌ Data validation failed for {retailer_name}")
+                # Save errors to file
+                await asyncio.to_thread(self.save_errors, errors, retailer_key)
+                return 0
+            
+            # Save to CSV off the event loop so other retailers keep scraping
+            await asyncio.to_thread(self.save_to_csv, products, retailer_key)
+        
+        # Only the statistics are kept; the products are released here
+        self.merge_summary(totals, summary)
+        
+        logger.info(f"✅ Successfully processed {len(products)} products from {retailer_name}")
+        return len(products)
+    
+    async def extract_all_data(self) -> Dict:
         """Main extraction method for all retailers"""
         logger.info("🚀 Starting comprehensive data extraction...")
         
+        self.start_run()
         await self.create_session()
         
-        all_products = []
+        # Streaming accumulators; prices are packed doubles for the median
+        totals = {
+            "total_products": 0,
+            "retailers": Counter(),
+            "categories": Counter(),
+            "prices": array('d')
+        }
         
         try:
-            for retailer_key in self.retailers.keys():
-                logger.info(f"\n📊 Processing {self.retailers[retailer_key]['name']}...")
-                
-                # Extract products
-                products = await self.scrape_retailer_products(retailer_key)
-                
-                if products:
-                    # Validate data
-                    is_valid, errors = self.validate_data_integrity(products)
-                    
-                    if is_valid:
-                        # Save to CSV
-                        self.save_to_csv(products, retailer_key)
-                        all_products.extend(products)
-                        
-                        logger.info(f"✅ Successfully processed {len(products)} products from {self.retailers[retailer_key]['name']}")
-                    else:
-                        logger.error(f"❌ Data validation failed for {self.retailers[retailer_key]['name']}")
-                        # Save errors to file
-                        error_file = self.data_dir / retailer_key / f"errors_{datetime.now().strftime('%Y-%m-%d')}.txt"
-                        with open(error_file, 'w') as f:
-                            f.write('\n'.join(errors))
-                
-                # Rate limiting between retailers
-                await asyncio.sleep(2)
+            # Retailers are scraped concurrently; each has its own rate limiter
+            results = await asyncio.gather(
+                *[self.process_retailer(retailer_key, totals) for retailer_key in self.retailers],
+                return_exceptions=True
+            )
+            
+            failures = []
+            for retailer_key, result in zip(self.retailers, results):
+                if isinstance(result, Exception):
+                    logger.error(f"❌ Error processing {self.retailers[retailer_key]['name']}: {str(result)}")
+                    failures.append(result)
+            
+            # Every retailer has finished by now; fail the run if any of them errored
+            if failures:
+                raise failures[0]
             
             # Generate summary report
-            self.generate_summary_report(all_products)
+            self.summary = self.generate_summary_report(totals)
             
             logger.info(f"\n🎉 Data extraction completed successfully!")
-            logger.info(f"📊 Total products extracted: {len(all_products)}")
+            logger.info(f"📊 Total products extracted: {totals['total_products']}")
             logger.info(f"🏪 Retailers processed: {len(self.retailers)}")
             
         except Exception as e:
@@ -424,68 +628,58 @@ class GroceryDataExtractor:
         finally:
             await self.close_session()
         
-        return all_products
+        return self.summary
     
-    def generate_summary_report(self, products: List[Product]):
-        """Generate summary report of extracted data"""
+    def generate_summary_report(self, totals: Dict) -> Dict:
+        """Generate summary report from statistics gathered by analyze_products"""
         summary = {
-            "extraction_date": datetime.now().isoformat(),
-            "total_products": len(products),
-            "retailers": {},
-            "categories": {},
+            "extraction_date": self.run_iso,
+            "total_products": totals["total_products"],
+            "retailers": dict(totals["retailers"]),
+            "categories": dict(totals["categories"]),
             "price_statistics": {}
         }
         
-        # Group by retailer
-        for product in products:
-            if product.retailer not in summary["retailers"]:
-                summary["retailers"][product.retailer] = 0
-            summary["retailers"][product.retailer] += 1
-            
-            if product.category not in summary["categories"]:
-                summary["categories"][product.category] = 0
-            summary["categories"][product.category] += 1
-        
         # Calculate price statistics
-        prices = [p.current_price for p in products if p.current_price]
+        prices = totals["prices"]
         if prices:
+            price_array = np.array(prices, dtype=np.float64)
             summary["price_statistics"] = {
-                "min_price": min(prices),
-                "max_price": max(prices),
-                "average_price": sum(prices) / len(prices),
-                "median_price": sorted(prices)[len(prices) // 2]
+                "min_price": float(np.min(price_array)),
+                "max_price": float(np.max(price_array)),
+                "average_price": float(np.mean(price_array)),
+                "median_price": float(np.median(price_array))
             }
         
         # Save summary
-        summary_file = self.data_dir / f"extraction_summary_{datetime.now().strftime('%Y-%m-%d')}.json"
-        with open(summary_file, 'w') as f:
-            json.dump(summary, f, indent=2)
+        summary_file = self.data_dir / f"extraction_summary_{self.run_date_str}.json"
+        with open(summary_file, 'wb') as f:
+            f.write(orjson.dumps(summary, option=orjson.OPT_INDENT_2))
         
         logger.info(f"📋 Summary report saved to {summary_file}")
+        
+        return summary
 
 async def main():
     """Main execution function"""
-    extractor = GroceryDataExtractor()
+    extractor = GroceryDataExtractor(
+        force_refresh=os.environ.get("FORCE_REFRESH", "").lower() == "true"
+    )
     
     try:
-        products = await extractor.extract_all_data()
+        summary = await extractor.extract_all_data()
         
         print("\n" + "="*50)
         print("🎯 EXTRACTION SUMMARY")
         print("="*50)
-        print(f"📦 Total products extracted: {len(products)}")
-        
-        # Group by retailer for summary
-        retailer_counts = {}
-        for product in products:
-            retailer_counts[product.retailer] = retailer_counts.get(product.retailer, 0) + 1
+        print(f"📦 Total products extracted: {summary['total_products']}")
         
         print("\n📊 Products by retailer:")
-        for retailer, count in retailer_counts.items():
+        for retailer, count in summary["retailers"].items():
             print(f"   {retailer}: {count} products")
         
         print(f"\n💾 Data saved to individual retailer folders in /data/")
-        print(f"📅 Timestamp: {datetime.now().strftime('%Y-%m-%d_%H:%M:%S')}")
+        print(f"📅 Timestamp: {extractor.run_date.strftime('%Y-%m-%d_%H:%M:%S')}")
         print("\n✅ Ready for integration with landing page!")
         
     except Exception as e:
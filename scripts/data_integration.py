@@ -4,18 +4,82 @@ Data Integration Script for Budget Sakkie
 Imports CSV data and updates the React application with latest prices
 """
 
-import csv
-import json
+import heapq
 import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, fields
 from datetime import datetime
+from itertools import chain, islice
 from pathlib import Path
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional, Tuple
 import logging
 
+import orjson
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Column types for the retailer price CSVs written by data_extractor.py
+_CSV_COLUMN_TYPES = {
+    'product_id': pa.string(),
+    'product_name': pa.string(),
+    'current_price': pa.string(),  # Parsed by parse_prices so bad cells only affect their row
+    'availability_status': pa.string(),
+    'last_updated': pa.string(),
+    'retailer': pa.string(),
+    'category': pa.string(),
+    'unit': pa.string(),
+    'image_url': pa.string()
+}
+
+# Values float() would accept for current_price; anything else becomes 0.0
+_PRICE_PATTERN = r'^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$'
+
+# Map retailer names to the IDs used by the React app
+_RETAILER_IDS = {
+    "Checkers": "checkers",
+    "Pick n Pay": "pick-n-pay",
+    "Woolworths": "woolworths",
+    "Shoprite": "shoprite",
+    "SPAR": "spar"
+}
+
+# Brand colors for each retailer
+_RETAILER_COLORS = {
+    "Checkers": "#00A651",
+    "Pick n Pay": "#E31837",
+    "Woolworths": "#00A86B",
+    "Shoprite": "#FF6B35",
+    "SPAR": "#006B3F"
+}
+_DEFAULT_RETAILER_COLOR = "#6B7280"
+
+# Indented output; NumPy values from the pandas/Arrow path serialize natively
+_ORJSON_OPTIONS = orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY
+
+@dataclass(slots=True)
+class ProductRow:
+    """Price record for one product at one retailer"""
+    product_id: str
+    product_name: str
+    current_price: float
+    availability_status: str
+    last_updated: str
+    retailer: str
+    category: str
+    unit: str
+    image_url: str
+    retailer_id: str
+    retailer_color: str
+    availability: str
+
+_PRODUCT_ROW_FIELDS = [field.name for field in fields(ProductRow)]
+
 class DataIntegrator:
     """Integrates scraped data with the React application"""
     
@@ -32,148 +96,187 @@ class DataIntegrator:
             logger.warning(f"⚠️ Directory not found: {retailer_dir}")
             return None
         
-        csv_files = list(retailer_dir.glob("*_prices.csv"))
+        # A single directory scan; DirEntry caches file type and stat results
+        with os.scandir(retailer_dir) as entries:
+            csv_files = [
+                (entry.name, entry.stat().st_mtime)
+                for entry in entries
+                if entry.name.endswith("_prices.csv") and entry.is_file()
+            ]
         
         if not csv_files:
             logger.warning(f"⚠️ No CSV files found in {retailer_dir}")
             return None
         
-        # Sort by modification time and return the latest
-        latest_file = max(csv_files, key=lambda f: f.stat().st_mtime)
+        # Pick the file with the latest modification time
+        latest_file = retailer_dir / max(csv_files, key=lambda f: f[1])[0]
         logger.info(f"📄 Latest file for {retailer}: {latest_file.name}")
         
         return latest_file
     
-    def load_csv_data(self, csv_file: Path) -> List[Dict[str, Any]]:
-        """Load data from CSV file"""
-        products = []
-        
+    def load_csv_data(self, csv_file: Path) -> Optional[pa.Table]:
+        """Load data from CSV file into an Arrow table"""
         try:
-            with open(csv_file, 'r', encoding='utf-8') as file:
-                reader = csv.DictReader(file)
-                for row in reader:
-                    # Convert price to float
-                    try:
-                        row['current_price'] = float(row['current_price'])
-                    except (ValueError, TypeError):
-                        row['current_price'] = 0.0
-                    
-                    products.append(row)
+            table = pacsv.read_csv(
+                csv_file,
+                convert_options=pacsv.ConvertOptions(column_types=_CSV_COLUMN_TYPES)
+            )
+            
+            # Missing or unparseable prices are treated as zero
+            price_index = table.schema.get_field_index('current_price')
+            table = table.set_column(
+                price_index, 'current_price', self.parse_prices(table['current_price'])
+            )
+            
+            # Normalize names once here so grouping can use them directly
+            table = table.append_column(
+                'normalized_name', pc.utf8_trim_whitespace(pc.utf8_lower(table['product_name']))
+            )
+            table = self.attach_retailer_info(table)
             
-            logger.info(f"✅ Loaded {len(products)} products from {csv_file.name}")
+            # The app spells availability with dashes (in-stock, low-stock, ...)
+            table = table.append_column(
+                'availability',
+                pc.replace_substring(table['availability_status'], pattern='_', replacement='-')
+            )
+            
+            logger.info(f"✅ Loaded {table.num_rows} products from {csv_file.name}")
+            return table
             
         except Exception as e:
             logger.error(f"❌ Error loading {csv_file}: {str(e)}")
-        
-        return products
+            return None
     
-    def find_best_prices(self, all_products: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
-        """Find best prices for each product across all retailers"""
-        product_groups = {}
+    def parse_prices(self, prices: pa.ChunkedArray) -> pa.ChunkedArray:
+        """Convert a string price column to float64, mapping invalid values to 0.0"""
+        prices = pc.utf8_trim_whitespace(prices)
+        valid = pc.fill_null(pc.match_substring_regex(prices, _PRICE_PATTERN), False)
+        return pc.cast(pc.if_else(valid, prices, "0"), pa.float64())
+    
+    def attach_retailer_info(self, table: pa.Table) -> pa.Table:
+        """Add retailer ID and color columns, looked up once per distinct retailer"""
+        # A retailer CSV normally holds a single retailer name
+        encoded = table['retailer'].combine_chunks().dictionary_encode()
+        names = encoded.dictionary.to_pylist()
+        
+        retailer_ids = pa.array([_RETAILER_IDS.get(name, 'unknown') for name in names], pa.string())
+        retailer_colors = pa.array(
+            [_RETAILER_COLORS.get(name, _DEFAULT_RETAILER_COLOR) for name in names], pa.string()
+        )
         
-        # Group products by name (normalize for comparison)
-        for product in all_products:
-            normalized_name = product['product_name'].lower().strip()
-            
-            if normalized_name not in product_groups:
-                product_groups[normalized_name] = []
-            
-            product_groups[normalized_name].append(product)
+        table = table.append_column('retailer_id', retailer_ids.take(encoded.indices))
+        return table.append_column('retailer_color', retailer_colors.take(encoded.indices))
+    
+    def find_best_prices(self, all_products: pa.Table) -> Tuple[Dict[str, Dict[str, Any]], float, int]:
+        """Find best prices for each product across all retailers
+        
+        Returns the per-product price data along with the total savings and
+        number of product groups, so averages need no second pass.
+        """
+        df = all_products.to_pandas()
+        
+        # Savings (difference between highest and lowest price) only consider valid prices
+        df['valid_price'] = df['current_price'].where(df['current_price'] > 0)
+        
+        # Group products by name (normalized when loaded) and reduce every group in one pass
+        grp = df.groupby('normalized_name', sort=False)
+        stats = grp.agg(
+            best=('current_price', 'idxmin'),  # The product with the lowest price
+            min=('valid_price', 'min'),
+            max=('valid_price', 'max'),
+            count=('valid_price', 'count')
+        )
+        best_index = stats['best']
+        savings = (stats['max'] - stats['min']).where(stats['count'] > 1, 0)
+        min_prices = stats['min'].fillna(0)
+        max_prices = stats['max'].fillna(0)
         
+        # Only row positions are kept; product_rows builds the rows that are actually emitted
         best_prices = {}
+        total_savings = 0
         
-        for product_name, products in product_groups.items():
-            if not products:
-                continue
-            
-            # Find the product with the lowest price
-            best_product = min(products, key=lambda p: p['current_price'])
-            
-            # Calculate savings (difference between highest and lowest price)
-            prices = [p['current_price'] for p in products if p['current_price'] > 0]
-            if len(prices) > 1:
-                max_price = max(prices)
-                min_price = min(prices)
-                savings = max_price - min_price
-            else:
-                savings = 0
-            
+        for product_name, best, saving, min_price, max_price in zip(
+            best_index.index, best_index.tolist(), savings.tolist(), min_prices.tolist(), max_prices.tolist()
+        ):
             best_prices[product_name] = {
-                'best_product': best_product,
-                'all_prices': products,
-                'savings': savings,
+                'best_index': best,
+                'price_indices': grp.indices[product_name],
+                'savings': saving,
                 'price_range': {
-                    'min': min(prices) if prices else 0,
-                    'max': max(prices) if prices else 0
+                    'min': min_price,
+                    'max': max_price
                 }
             }
+            total_savings += saving
         
-        return best_prices
+        return best_prices, total_savings, len(best_prices)
+    
+    def product_rows(self, all_products: pa.Table, indices) -> List[ProductRow]:
+        """Build ProductRow records for the given row positions of the products table"""
+        selected = all_products.select(_PRODUCT_ROW_FIELDS).take(pa.array(indices, pa.int64()))
+        return [ProductRow(*values) for values in zip(*(column.to_pylist() for column in selected.columns))]
     
-    def generate_mock_data_update(self, best_prices: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    def generate_mock_data_update(self, all_products: pa.Table, best_prices: Dict[str, Dict[str, Any]], total_savings: float, group_count: int) -> Dict[str, Any]:
         """Generate updated mock data for the React application"""
         
-        # Map retailer names to IDs
-        retailer_mapping = {
-            "Checkers": "checkers",
-            "Pick n Pay": "pick-n-pay", 
-            "Woolworths": "woolworths",
-            "Shoprite": "shoprite",
-            "SPAR": "spar"
-        }
+        selected = list(islice(best_prices.values(), 20))  # Limit to 20 products
+        
+        # Rows for the selected products only, each fetched with a single take
+        best_products = self.product_rows(all_products, [price_data['best_index'] for price_data in selected])
+        price_rows = self.product_rows(
+            all_products, list(chain.from_iterable(price_data['price_indices'] for price_data in selected))
+        )
+        remaining_rows = iter(price_rows)
         
-        # Create updated products array
-        updated_products = []
-        updated_prices = []
+        # Create updated products and prices arrays, sized up front
+        updated_products = [None] * len(selected)
+        updated_prices = [None] * len(price_rows)
         
         product_id = 1
         price_id = 1
         
-        for product_name, price_data in list(best_prices.items())[:20]:  # Limit to 20 products
-            best_product = price_data['best_product']
+        for price_data, best_product in zip(selected, best_products):
             
             # Create product entry
             product_entry = {
                 "id": str(product_id),
-                "name": best_product['product_name'],
+                "name": best_product.product_name,
                 "brand": "Generic",  # Could be enhanced with brand detection
-                "category": best_product.get('category', 'General'),
+                "category": best_product.category,
                 "barcode": f"600123456789{product_id}",
-                "image": best_product.get('image_url', f"https://images.pexels.com/photos/{300000 + product_id}/product.jpg?auto=compress&cs=tinysrgb&w=300&h=200&fit=crop"),
+                "image": best_product.image_url,
                 "unit": "each",
-                "unitSize": best_product.get('unit', 'each')
+                "unitSize": best_product.unit
             }
             
-            updated_products.append(product_entry)
+            updated_products[product_id - 1] = product_entry
             
             # Create price entries for all retailers selling this product
-            for product in price_data['all_prices']:
-                retailer_id = retailer_mapping.get(product['retailer'], 'unknown')
-                
+            for product in islice(remaining_rows, len(price_data['price_indices'])):
                 price_entry = {
                     "id": f"{product_id}-{price_id}",
                     "productId": str(product_id),
                     "retailer": {
-                        "id": retailer_id,
-                        "name": product['retailer'],
+                        "id": product.retailer_id,
+                        "name": product.retailer,
                         "logo": f"https://images.pexels.com/photos/{400000 + price_id}/logo.jpg?auto=compress&cs=tinysrgb&w=100&h=100&fit=crop",
-                        "color": self.get_retailer_color(product['retailer']),
+                        "color": product.retailer_color,
                         "locations": [{
-                            "id": f"{retailer_id}-1",
-                            "name": f"{product['retailer']} Centurion",
+                            "id": f"{product.retailer_id}-1",
+                            "name": f"{product.retailer} Centurion",
                             "address": "Centurion Mall, Centurion",
                             "distance": 2.3,
                             "coordinates": [-25.8553, 28.1881],
                             "openingHours": "Mon-Sun: 8:00-21:00"
                         }]
                     },
-                    "price": product['current_price'],
+                    "price": product.current_price,
                     "onSale": False,
-                    "lastUpdated": product['last_updated'],
-                    "availability": product['availability_status'].replace('_', '-')
+                    "lastUpdated": product.last_updated,
+                    "availability": product.availability
                 }
                 
-                updated_prices.append(price_entry)
+                updated_prices[price_id - 1] = price_entry
                 price_id += 1
             
             product_id += 1
@@ -185,21 +288,10 @@ class DataIntegrator:
             "summary": {
                 "totalProducts": len(updated_products),
                 "totalPrices": len(updated_prices),
-                "avgSavings": sum(data['savings'] for data in best_prices.values()) / len(best_prices) if best_prices else 0
+                "avgSavings": total_savings / group_count if group_count else 0
             }
         }
     
-    def get_retailer_color(self, retailer_name: str) -> str:
-        """Get brand color for retailer"""
-        colors = {
-            "Checkers": "#00A651",
-            "Pick n Pay": "#E31837", 
-            "Woolworths": "#00A86B",
-            "Shoprite": "#FF6B35",
-            "SPAR": "#006B3F"
-        }
-        return colors.get(retailer_name, "#6B7280")
-    
     def update_mock_data_file(self, updated_data: Dict[str, Any]):
         """Update the mockData.ts file with new data"""
         mock_data_file = self.src_dir / "data" / "mockData.ts"
@@ -208,36 +300,36 @@ class DataIntegrator:
             logger.error(f"❌ Mock data file not found: {mock_data_file}")
             return False
         
+        tmp_file = mock_data_file.with_suffix('.ts.tmp')
+        backup_file = mock_data_file.with_suffix('.ts.backup')
+        backup_tmp_file = mock_data_file.with_suffix('.ts.backup.tmp')
+        
         try:
             # Read the current file
-            with open(mock_data_file, 'r', encoding='utf-8') as file:
-                content = file.read()
-            
-            # Create backup
-            backup_file = mock_data_file.with_suffix('.ts.backup')
-            with open(backup_file, 'w', encoding='utf-8') as file:
-                file.write(content)
+            content = mock_data_file.read_text(encoding='utf-8')
             
             # Generate new products and prices arrays
             products_js = self.dict_to_js_array(updated_data['products'])
             prices_js = self.dict_to_js_array(updated_data['prices'])
             
-            # Replace the products array
-            import re
+            # Splice the new arrays in place of the existing declarations
+            content = self.replace_js_array(content, "export const products: Product[]", products_js)
+            content = self.replace_js_array(content, "export const prices: Price[]", prices_js)
             
-            # Replace products array
-            products_pattern = r'export const products: Product\[\] = \[.*?\];'
-            new_products = f"export const products: Product[] = {products_js};"
-            content = re.sub(products_pattern, new_products, content, flags=re.DOTALL)
+            # Write updated content to a temporary file first
+            tmp_file.write_bytes(content.encode('utf-8'))
             
-            # Replace prices array  
-            prices_pattern = r'export const prices: Price\[\] = \[.*?\];'
-            new_prices = f"export const prices: Price[] = {prices_js};"
-            content = re.sub(prices_pattern, new_prices, content, flags=re.DOTALL)
+            # Back up the old file (hard link, or a copy where links aren't supported)
+            # before the previous backup is replaced
+            backup_tmp_file.unlink(missing_ok=True)
+            try:
+                os.link(mock_data_file, backup_tmp_file)
+            except OSError:
+                shutil.copy2(mock_data_file, backup_tmp_file)
+            os.replace(backup_tmp_file, backup_file)
             
-            # Write updated content
-            with open(mock_data_file, 'w', encoding='utf-8') as file:
-                file.write(content)
+            # Swap the new content in atomically
+            os.replace(tmp_file, mock_data_file)
             
             logger.info(f"✅ Updated mock data file: {mock_data_file}")
             logger.info(f"💾 Backup saved to: {backup_file}")
@@ -247,72 +339,66 @@ class DataIntegrator:
         except Exception as e:
             logger.error(f"❌ Error updating mock data file: {str(e)}")
             return False
+        
+        finally:
+            # Nothing is left behind if a replace didn't happen
+            tmp_file.unlink(missing_ok=True)
+            backup_tmp_file.unlink(missing_ok=True)
     
-    def dict_to_js_array(self, data: List[Dict[str, Any]]) -> str:
-        """Convert Python dict to JavaScript array string"""
-        js_items = []
+    def replace_js_array(self, content: str, declaration: str, array_js: str) -> str:
+        """Replace the array literal assigned by a declaration, up to its closing '];'"""
+        start = content.find(f"{declaration} = [")
+        if start == -1:
+            return content
         
-        for item in data:
-            js_item = self.dict_to_js_object(item)
-            js_items.append(js_item)
+        end = content.find("];", start)
+        if end == -1:
+            return content
         
-        return "[\n  " + ",\n  ".join(js_items) + "\n]"
+        return "".join((content[:start], f"{declaration} = {array_js};", content[end + 2:]))
     
-    def dict_to_js_object(self, obj: Any, indent: int = 2) -> str:
-        """Convert Python object to JavaScript object string"""
-        if isinstance(obj, dict):
-            items = []
-            for key, value in obj.items():
-                js_value = self.dict_to_js_object(value, indent + 2)
-                items.append(f"{'  ' * indent}{key}: {js_value}")
-            return "{\n" + ",\n".join(items) + f"\n{'  ' * (indent-2)}}}"
-        
-        elif isinstance(obj, list):
-            if not obj:
-                return "[]"
-            items = [self.dict_to_js_object(item, indent + 2) for item in obj]
-            return "[\n" + f"{'  ' * indent}" + f",\n{'  ' * indent}".join(items) + f"\n{'  ' * (indent-2)}]"
-        
-        elif isinstance(obj, str):
-            return f"'{obj}'"
-        
-        elif isinstance(obj, bool):
-            return "true" if obj else "false"
-        
-        elif obj is None:
-            return "null"
-        
-        else:
-            return str(obj)
+    def dict_to_js_array(self, data: List[Dict[str, Any]]) -> str:
+        """Convert Python dicts to a JavaScript array string (JSON is a valid TS literal)"""
+        return orjson.dumps(data, option=_ORJSON_OPTIONS).decode()
     
     def integrate_data(self):
         """Main integration method"""
         logger.info("🔄 Starting data integration...")
         
-        all_products = []
+        csv_files = {}
         
-        # Load data from all retailers
+        # Find the latest data for all retailers
         for retailer in self.retailers:
             latest_csv = self.find_latest_csv(retailer)
             
             if latest_csv:
-                products = self.load_csv_data(latest_csv)
-                all_products.extend(products)
+                csv_files[retailer] = latest_csv
             else:
                 logger.warning(f"⚠️ No data found for {retailer}")
         
-        if not all_products:
+        # Each file is read and parsed on its own thread, so I/O and parsing overlap (Arrow releases the GIL)
+        loaded = []
+        
+        if csv_files:
+            with ThreadPoolExecutor(max_workers=len(csv_files)) as executor:
+                loaded = list(executor.map(self.load_csv_data, csv_files.values()))
+        
+        tables = [table for table in loaded if table is not None]
+        
+        all_products = pa.concat_tables(tables) if tables else None
+        
+        if all_products is None or all_products.num_rows == 0:
             logger.error("❌ No product data found to integrate")
             return False
         
-        logger.info(f"📊 Total products loaded: {len(all_products)}")
+        logger.info(f"📊 Total products loaded: {all_products.num_rows}")
         
         # Find best prices
-        best_prices = self.find_best_prices(all_products)
-        logger.info(f"🎯 Found best prices for {len(best_prices)} unique products")
+        best_prices, total_savings, group_count = self.find_best_prices(all_products)
+        logger.info(f"🎯 Found best prices for {group_count} unique products")
         
         # Generate updated mock data
-        updated_data = self.generate_mock_data_update(best_prices)
+        updated_data = self.generate_mock_data_update(all_products, best_prices, total_savings, group_count)
         
         # Update the mock data file
         success = self.update_mock_data_file(updated_data)
@@ -323,11 +409,11 @@ class DataIntegrator:
             logger.info(f"💰 Average savings: R{updated_data['summary']['avgSavings']:.2f}")
             
             # Generate integration report
-            self.generate_integration_report(updated_data, best_prices)
+            self.generate_integration_report(updated_data, best_prices, all_products)
             
         return success
     
-    def generate_integration_report(self, updated_data: Dict[str, Any], best_prices: Dict[str, Dict[str, Any]]):
+    def generate_integration_report(self, updated_data: Dict[str, Any], best_prices: Dict[str, Dict[str, Any]], all_products: pa.Table):
         """Generate integration report"""
         report = {
             "integration_date": datetime.now().isoformat(),
@@ -336,28 +422,27 @@ class DataIntegrator:
             "price_comparisons": []
         }
         
-        # Find best deals (highest savings)
-        sorted_deals = sorted(
-            best_prices.items(), 
-            key=lambda x: x[1]['savings'], 
-            reverse=True
+        # Find best deals (highest savings) without sorting every product
+        top_deals = heapq.nlargest(
+            10,  # Top 10 deals
+            (item for item in best_prices.items() if item[1]['savings'] > 0),
+            key=lambda x: x[1]['savings']
         )
         
-        for product_name, data in sorted_deals[:10]:  # Top 10 deals
-            if data['savings'] > 0:
-                best_product = data['best_product']
-                report["best_deals"].append({
-                    "product": product_name,
-                    "best_price": best_product['current_price'],
-                    "best_retailer": best_product['retailer'],
-                    "savings": data['savings'],
-                    "price_range": data['price_range']
-                })
+        best_products = self.product_rows(all_products, [data['best_index'] for _, data in top_deals])
+        
+        for (product_name, data), best_product in zip(top_deals, best_products):
+            report["best_deals"].append({
+                "product": product_name,
+                "best_price": best_product.current_price,
+                "best_retailer": best_product.retailer,
+                "savings": data['savings'],
+                "price_range": data['price_range']
+            })
         
         # Save report
         report_file = self.data_dir / f"integration_report_{datetime.now().strftime('%Y-%m-%d')}.json"
-        with open(report_file, 'w') as f:
-            json.dump(report, f, indent=2)
+        report_file.write_bytes(orjson.dumps(report, option=_ORJSON_OPTIONS))
         
         logger.info(f"📋 Integration report saved to {report_file}")
 
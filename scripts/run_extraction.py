@@ -13,6 +13,13 @@ import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def count_csv_files(retailer_dir: Path):
+    """Count price CSV files in a retailer directory, or None if it is missing"""
+    if not retailer_dir.exists():
+        return None
+    
+    return len(list(retailer_dir.glob("*_prices.csv")))
+
 async def run_complete_pipeline():
     """Run the complete data extraction and integration pipeline"""
     
@@ -50,19 +57,24 @@ async def run_complete_pipeline():
         data_dir = Path("data")
         retailers = ["checkers", "pick_n_pay", "woolworths", "shoprite", "spar"]
         
+        mock_data_file = Path("src/data/mockData.ts")
+        
+        # Scan retailer directories and check the mock data file concurrently
+        *counts, mock_data_exists = await asyncio.gather(
+            *[asyncio.to_thread(count_csv_files, data_dir / retailer) for retailer in retailers],
+            asyncio.to_thread(mock_data_file.exists)
+        )
+        
         total_files = 0
-        for retailer in retailers:
-            retailer_dir = data_dir / retailer
-            if retailer_dir.exists():
-                csv_files = list(retailer_dir.glob("*_prices.csv"))
-                total_files += len(csv_files)
-                print(f"   📁 {retailer}: {len(csv_files)} CSV files")
+        for retailer, count in zip(retailers, counts):
+            if count is not None:
+                total_files += count
+                print(f"   📁 {retailer}: {count} CSV files")
         
         print(f"   📊 Total CSV files: {total_files}")
         
         # Check if mock data was updated
-        mock_data_file = Path("src/data/mockData.ts")
-        if mock_data_file.exists():
+        if mock_data_exists:
             print("   ✅ Mock data file updated")
         else:
             print("   ⚠️ Mock data file not found")